@@ -1,7 +1,7 @@
-# app.py — Flask app with Azure OpenAI, persistence, auth, and rate limiting
+# app.py — Flask app with Azure OpenAI, persistence, auth, rate limiting, and tracing
 import os
 import json
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from dotenv import load_dotenv
 import requests
 from datetime import datetime, timedelta
@@ -9,6 +9,8 @@ import sqlite3
 import hashlib
 import secrets
 
+import tracing
+
 load_dotenv()  # loads .env into environment if present
 
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -29,6 +31,9 @@ API_KEY_SALT = os.getenv("API_KEY_SALT", "default-salt-change-in-production")
 RATE_LIMIT_REQUESTS = 100  # requests per window
 RATE_LIMIT_WINDOW = 3600   # 1 hour in seconds
 
+# Tracing is configured from TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_EXPORTER, etc.
+tracing.configure()
+
 app = Flask(__name__)
 
 # In-memory rate limiting and authentication tracking
@@ -80,6 +85,7 @@ def hash_api_key(api_key):
     """Hash API key for storage"""
     return hashlib.sha256(f"{api_key}{API_KEY_SALT}".encode()).hexdigest()
 
+@tracing.traced("auth.validate_api_key")
 def validate_api_key(api_key):
     """Validate API key from Authorization header"""
     if not api_key:
@@ -129,6 +135,7 @@ def check_rate_limit(identifier):
     rate_limits[identifier].append(now)
     return True
 
+@tracing.traced("db.get_or_create_session")
 def get_or_create_session(session_id, user_id=None):
     """Get or create a conversation session in database"""
     try:
@@ -145,6 +152,7 @@ def get_or_create_session(session_id, user_id=None):
     except Exception as e:
         print(f"Session creation error: {e}")
 
+@tracing.traced("db.save_message")
 def save_message(session_id, role, content):
     """Save message to database"""
     try:
@@ -161,6 +169,7 @@ def save_message(session_id, role, content):
     except Exception as e:
         print(f"Message save error: {e}")
 
+@tracing.traced("db.get_persistent_history")
 def get_persistent_history(session_id, limit=50):
     """Get conversation history from database"""
     try:
@@ -227,6 +236,49 @@ def generate_api_key():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.before_request
+def start_request_trace():
+    """Open the root span for the request, continuing an incoming traceparent"""
+    if not tracing.is_enabled():
+        return
+    # Read the WSGI environ directly; each request attribute goes through a proxy
+    environ = request.environ
+    method = environ["REQUEST_METHOD"]
+    rule = request.url_rule
+    if rule is not None:
+        name = f"{method} {rule.rule}"
+        attributes = {"http.method": method, "http.route": rule.rule}
+    else:
+        # Unmatched paths are client-controlled, so keep them out of the span name
+        name = method
+        attributes = {"http.method": method, "http.target": request.path}
+    g.trace = tracing.begin_span(
+        name,
+        kind="server",
+        attributes=attributes,
+        traceparent=environ.get("HTTP_TRACEPARENT"),
+    )
+
+@app.after_request
+def record_request_status(response):
+    """Record the response status on the request span"""
+    span = tracing.current_span()
+    if span is not None:
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    """Close the request span"""
+    trace = g.pop("trace", None)
+    if trace is not None:
+        span, token = trace
+        if exc is not None:
+            span.set_error(str(exc))
+        tracing.end_span(span, token)
+
 @app.before_request
 def authenticate_request():
     """Authenticate requests using API key"""
@@ -284,9 +336,13 @@ def chat():
             url = f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT}/completions?api-version=2023-06-01-preview"
             headers = {"api-key": AZURE_KEY, "Content-Type": "application/json"}
             body = {"prompt": validated_prompt, "max_tokens": 200}
-            r = requests.post(url, json=body, headers=headers, timeout=15)
-            r.raise_for_status()
-            response_data = r.json()
+            with tracing.start_span("azure.completions", kind="client",
+                                    attributes={"azure.deployment": AZURE_DEPLOYMENT}) as span:
+                # Propagate trace context to the upstream call
+                r = requests.post(url, json=body, headers=tracing.inject(headers), timeout=15)
+                span.set_attribute("http.status_code", r.status_code)
+                r.raise_for_status()
+                response_data = r.json()
             
             # Extract text from Azure response
             assistant_reply = response_data.get("choices", [{}])[0].get("text", "").strip()
@@ -0,0 +1,386 @@
+# tracing.py — lightweight OpenTelemetry-compatible tracing for the chatbot
+#
+# Spans use W3C Trace Context ids and are exported as OTLP/JSON, so the output
+# can be read by any OpenTelemetry collector without pulling in the SDK.
+import os
+import json
+import time
+import random
+import atexit
+import re
+import threading
+import functools
+import contextvars
+from collections import deque
+
+import requests
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+STATUS_ERROR = 2
+SCOPE_NAME = "azure-openai-chatbot"
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_processor = None
+_enabled = False
+_sample_threshold = 0
+_service_name = "azure-openai-chatbot"
+
+
+class Span:
+    """A single timed operation within a trace"""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled",
+                 "start_ns", "end_ns", "attributes", "status", "status_message")
+
+    def __init__(self, name, kind, trace_id, parent_id, sampled, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        # Unsampled spans are never exported, so they keep no attributes
+        self.attributes = dict(attributes) if attributes and sampled else {}
+        self.status = 0
+        self.status_message = ""
+
+    def set_attribute(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled and _processor is not None:
+            _processor.on_end(self)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class _NoopSpan:
+    """Stand-in used while tracing is disabled"""
+
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# ============== EXPORTERS ==============
+
+# The encoder below writes OTLP/JSON by hand: building dicts for json.dumps
+# costs about twice as much, and export shares the GIL with request threads.
+# Ids are validated hex and timestamps are ints, so only names, attribute
+# keys, and string values need escaping. The fragment caches are capped so
+# that unexpected names cannot grow them without bound.
+_MAX_CACHED_FRAGMENTS = 256
+_span_heads = {}
+_attribute_keys = {}
+
+
+def _otlp_attribute(key, value):
+    prefix = _attribute_keys.get(key)
+    if prefix is None:
+        prefix = '{"key":%s,"value":' % json.dumps(key)
+        if len(_attribute_keys) < _MAX_CACHED_FRAGMENTS:
+            _attribute_keys[key] = prefix
+    if isinstance(value, bool):
+        return prefix + ('{"boolValue":true}}' if value else '{"boolValue":false}}')
+    if isinstance(value, int):
+        return prefix + '{"intValue":"%d"}}' % value
+    if isinstance(value, float):
+        return prefix + '{"doubleValue":%s}}' % json.dumps(value)
+    return prefix + '{"stringValue":%s}}' % json.dumps(str(value))
+
+
+def _otlp_span(span):
+    head = _span_heads.get((span.name, span.kind))
+    if head is None:
+        head = '"name":%s,"kind":%d' % (json.dumps(span.name), SPAN_KINDS[span.kind])
+        if len(_span_heads) < _MAX_CACHED_FRAGMENTS:
+            _span_heads[(span.name, span.kind)] = head
+    out = '{"traceId":"%s","spanId":"%s",%s,"startTimeUnixNano":"%d","endTimeUnixNano":"%d"' % (
+        span.trace_id, span.span_id, head, span.start_ns, span.end_ns)
+    if span.parent_id:
+        out += ',"parentSpanId":"%s"' % span.parent_id
+    if span.attributes:
+        out += ',"attributes":[%s]' % ",".join(
+            [_otlp_attribute(k, v) for k, v in span.attributes.items()])
+    # Unset status is the OTLP default, so only errors need encoding
+    if span.status:
+        out += ',"status":{"code":%d,"message":%s}' % (span.status, json.dumps(span.status_message))
+    return out + "}"
+
+
+def encode_otlp(spans, service_name=None):
+    """Encode finished spans as an OTLP/JSON ExportTraceServiceRequest string"""
+    return (
+        '{"resourceSpans":[{"resource":{"attributes":[{"key":"service.name","value":'
+        '{"stringValue":%s}}]},"scopeSpans":[{"scope":{"name":%s},"spans":[%s]}]}]}'
+        % (json.dumps(service_name or _service_name), json.dumps(SCOPE_NAME),
+           ",".join([_otlp_span(span) for span in spans]))
+    )
+
+
+class FileSpanExporter:
+    """Append each batch as one OTLP/JSON line (collector file-exporter format)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(encode_otlp(spans) + "\n")
+
+    def shutdown(self):
+        pass
+
+
+class OtlpHttpSpanExporter:
+    """POST batches to an OTLP/HTTP collector; batches are dropped if it is unreachable"""
+
+    def __init__(self, endpoint, timeout=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        # Own session so patching requests.post in the app does not capture exports
+        self.session = requests.Session()
+
+    def export(self, spans):
+        r = self.session.post(
+            self.endpoint,
+            data=encode_otlp(spans),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+
+    def shutdown(self):
+        self.session.close()
+
+
+class BatchSpanProcessor:
+    """Queue finished spans and export them in batches from a background thread"""
+
+    def __init__(self, exporter, max_batch_size=512, flush_interval=5.0, max_queue_size=2048):
+        self.exporter = exporter
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        # Bounded so a stalled exporter drops the oldest spans instead of growing memory
+        self.queue = deque(maxlen=max_queue_size)
+        self.export_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.worker = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self.worker.start()
+
+    def on_end(self, span):
+        self.queue.append(span)
+        # Only signal when the worker is idle; Event.set takes a lock on every call
+        if len(self.queue) >= self.max_batch_size and not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self._export_pending()
+
+    def _export_pending(self):
+        with self.export_lock:
+            while self.queue:
+                batch = []
+                while self.queue and len(batch) < self.max_batch_size:
+                    batch.append(self.queue.popleft())
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    print(f"Trace export error: {e}")
+
+    def force_flush(self):
+        self._export_pending()
+
+    def shutdown(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.worker.join(timeout=self.flush_interval)
+        self._export_pending()
+        self.exporter.shutdown()
+
+
+# ============== CONFIGURATION ==============
+
+def configure(enabled=None, sample_rate=None, exporter=None, service_name=None,
+              max_batch_size=None, flush_interval=None):
+    """(Re)configure tracing; unset arguments fall back to environment variables"""
+    global _processor, _enabled, _sample_threshold, _service_name
+
+    if enabled is None:
+        enabled = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+    if sample_rate is None:
+        sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    if service_name is None:
+        service_name = os.getenv("TRACE_SERVICE_NAME", "azure-openai-chatbot")
+    if max_batch_size is None:
+        max_batch_size = int(os.getenv("TRACE_BATCH_SIZE", "512"))
+    if flush_interval is None:
+        flush_interval = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+
+    shutdown()
+    _enabled = enabled
+    _service_name = service_name
+    sample_rate = min(max(sample_rate, 0.0), 1.0)
+    _sample_threshold = int(sample_rate * (1 << 64))
+    if not enabled:
+        return
+
+    if exporter is None:
+        if os.getenv("TRACE_EXPORTER", "file").lower() == "otlp":
+            exporter = OtlpHttpSpanExporter(
+                os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+        else:
+            exporter = FileSpanExporter(os.getenv("TRACE_FILE_PATH", "traces.jsonl"))
+    _processor = BatchSpanProcessor(exporter, max_batch_size=max_batch_size,
+                                    flush_interval=flush_interval)
+
+
+def is_enabled():
+    return _enabled
+
+
+def force_flush():
+    if _processor is not None:
+        _processor.force_flush()
+
+
+def shutdown():
+    global _processor
+    if _processor is not None:
+        _processor.shutdown()
+        _processor = None
+
+
+atexit.register(shutdown)
+
+
+# ============== CONTEXT & PROPAGATION ==============
+
+def parse_traceparent(header):
+    """Parse a W3C traceparent header into (trace_id, span_id, sampled) or None"""
+    if not header:
+        return None
+    header = header.strip()
+    match = _TRACEPARENT_RE.fullmatch(header[:55])
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff":
+        return None
+    # Version 00 has exactly four fields; later versions may append more after a dash
+    if len(header) > 55 and (version == "00" or header[55] != "-"):
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def inject(headers):
+    """Add the current span's traceparent to outgoing request headers"""
+    span = _current_span.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent()
+    return headers
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _new_span(name, kind, attributes, remote_parent=None):
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(name, kind, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    if remote_parent is not None:
+        trace_id, parent_id, sampled = remote_parent
+        return Span(name, kind, trace_id, parent_id, sampled, attributes)
+    # Ratio sampling on the low 64 bits of the trace id, as in TraceIdRatioBased
+    low = random.getrandbits(64)
+    trace_id = "%016x%016x" % (random.getrandbits(64), low)
+    return Span(name, kind, trace_id, None, low < _sample_threshold, attributes)
+
+
+def begin_span(name, kind="internal", attributes=None, traceparent=None):
+    """Start a span and make it current; returns (span, token) for end_span
+
+    traceparent is an incoming W3C header, used only when there is no current span.
+    """
+    if not _enabled:
+        return NOOP_SPAN, None
+    span = _new_span(name, kind, attributes, parse_traceparent(traceparent))
+    return span, _current_span.set(span)
+
+
+def end_span(span, token):
+    """End a span started with begin_span and restore the previous current span"""
+    if token is not None:
+        _current_span.reset(token)
+    span.end()
+
+
+class start_span:
+    """Context manager that traces the enclosed block as a child of the current span"""
+
+    # A plain class rather than @contextmanager, which costs a generator per span
+    __slots__ = ("name", "kind", "attributes", "span", "token")
+
+    def __init__(self, name, kind="internal", attributes=None):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+
+    def __enter__(self):
+        # Begin here, not in __init__, so an unentered start_span never becomes current
+        self.span, self.token = begin_span(self.name, self.kind, self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.span.set_error(str(exc))
+        end_span(self.span, self.token)
+        return False
+
+
+def traced(name, kind="internal"):
+    """Decorator that wraps each call of the function in a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            span, token = begin_span(name, kind)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                span.set_error(str(e))
+                raise
+            finally:
+                end_span(span, token)
+        return wrapper
+    return decorator
@@ -7,13 +7,18 @@ Tests cover:
 - Input validation
 - API endpoints
 - Session management
+- Distributed tracing
 """
 
 import pytest
 import os
 import sys
 import tempfile
+import json
+import threading
+import time
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 
 # Add src to path
@@ -338,5 +343,348 @@ class TestIntegration:
         assert len(hist_b) > 0
 
 
+# ============== TRACING ==============
+
+@pytest.fixture
+def collector():
+    """Local stand-in for an OTLP/HTTP collector that records exported spans"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.path, json.loads(body)))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/traces", received
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def traced_client(client, collector):
+    """Client with tracing enabled and exporting to the collector stand-in"""
+    import tracing
+    endpoint, _ = collector
+    tracing.configure(enabled=True, sample_rate=1.0,
+                      exporter=tracing.OtlpHttpSpanExporter(endpoint))
+    yield client
+    tracing.configure(enabled=False)
+
+
+def exported_spans(received):
+    """Flatten spans out of the OTLP/JSON payloads received by the collector"""
+    import tracing
+    tracing.force_flush()
+    return [
+        span
+        for _, payload in received
+        for resource in payload["resourceSpans"]
+        for scope in resource["scopeSpans"]
+        for span in scope["spans"]
+    ]
+
+
+def azure_response():
+    response = Mock(status_code=200)
+    response.json.return_value = {"choices": [{"text": "hi there"}]}
+    return response
+
+
+class TestTracing:
+    """Test spans, context propagation, sampling, and exporters"""
+
+    def test_chat_span_structure(self, traced_client, collector):
+        """A /chat request yields a root span with one child per stage"""
+        _, received = collector
+        api_key = traced_client.post('/auth/generate-key').json['api_key']
+        received.clear()
+
+        with patch('app.LOCAL_MODE', False), \
+             patch('app.AZURE_ENDPOINT', 'https://example.openai.azure.com'), \
+             patch('app.AZURE_KEY', 'k'), \
+             patch('app.AZURE_DEPLOYMENT', 'd'), \
+             patch('app.requests.post', return_value=azure_response()) as post:
+            response = traced_client.post(
+                '/chat',
+                json={'prompt': 'hello'},
+                headers={'Authorization': f'Bearer {api_key}'}
+            )
+        assert response.status_code == 200
+
+        spans = [s for s in exported_spans(received) if s['name'] != 'POST /auth/generate-key']
+        assert all(path == '/v1/traces' for path, _ in received)
+        names = sorted(s['name'] for s in spans)
+        assert names == sorted([
+            'POST /chat',
+            'auth.validate_api_key',
+            'db.get_or_create_session',
+            'db.save_message',
+            'db.save_message',
+            'azure.completions',
+        ])
+
+        root = next(s for s in spans if s['name'] == 'POST /chat')
+        assert 'parentSpanId' not in root
+        assert root['kind'] == 2
+        assert {'key': 'http.status_code', 'value': {'intValue': '200'}} in root['attributes']
+        for span in spans:
+            assert span['traceId'] == root['traceId']
+            if span is not root:
+                assert span['parentSpanId'] == root['spanId']
+            assert int(span['endTimeUnixNano']) >= int(span['startTimeUnixNano'])
+
+        # Trace context is propagated to the upstream call
+        upstream = next(s for s in spans if s['name'] == 'azure.completions')
+        assert upstream['kind'] == 3
+        sent_headers = post.call_args.kwargs['headers']
+        assert sent_headers['traceparent'] == f"00-{root['traceId']}-{upstream['spanId']}-01"
+
+    def test_incoming_traceparent_continued(self, traced_client, collector):
+        """An incoming traceparent header becomes the parent of the request span"""
+        _, received = collector
+        trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+        parent_id = '00f067aa0ba902b7'
+        traced_client.get('/health', headers={'traceparent': f'00-{trace_id}-{parent_id}-01'})
+
+        spans = exported_spans(received)
+        assert len(spans) == 1
+        assert spans[0]['traceId'] == trace_id
+        assert spans[0]['parentSpanId'] == parent_id
+
+    def test_unmatched_path_not_in_span_name(self, traced_client, collector):
+        """Unmatched paths use a fixed span name and keep the path in an attribute"""
+        import tracing
+        _, received = collector
+        for i in range(3):
+            traced_client.get(f'/nope/{i}')
+
+        spans = exported_spans(received)
+        assert [s['name'] for s in spans] == ['GET'] * 3
+        assert {'key': 'http.target', 'value': {'stringValue': '/nope/2'}} in spans[2]['attributes']
+        assert not any('/nope' in name for name, _ in tracing._span_heads)
+
+    def test_encoder_caches_bounded(self):
+        """Distinct span names beyond the cap are encoded but not cached"""
+        import tracing
+        spans = []
+        for i in range(tracing._MAX_CACHED_FRAGMENTS + 50):
+            span = tracing.Span(f'op{i}', 'internal', 'a' * 32, None, True, {f'k{i}': i})
+            span.end_ns = span.start_ns
+            spans.append(span)
+
+        payload = json.loads(tracing.encode_otlp(spans))
+        assert len(payload['resourceSpans'][0]['scopeSpans'][0]['spans']) == len(spans)
+        assert len(tracing._span_heads) <= tracing._MAX_CACHED_FRAGMENTS
+        assert len(tracing._attribute_keys) <= tracing._MAX_CACHED_FRAGMENTS
+
+    def test_unsampled_requests_not_exported(self, client, collector):
+        """Sample rate of zero exports nothing"""
+        import tracing
+        endpoint, received = collector
+        tracing.configure(enabled=True, sample_rate=0.0,
+                          exporter=tracing.OtlpHttpSpanExporter(endpoint))
+        try:
+            for _ in range(5):
+                client.get('/health')
+            assert exported_spans(received) == []
+        finally:
+            tracing.configure(enabled=False)
+
+    def test_sampled_flag_respected_from_parent(self, client, collector):
+        """Parent sampling decision overrides the local sample rate"""
+        import tracing
+        endpoint, received = collector
+        tracing.configure(enabled=True, sample_rate=0.0,
+                          exporter=tracing.OtlpHttpSpanExporter(endpoint))
+        try:
+            client.get('/health', headers={
+                'traceparent': '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+            })
+            assert len(exported_spans(received)) == 1
+        finally:
+            tracing.configure(enabled=False)
+
+    def test_parse_traceparent(self):
+        """Malformed traceparent headers are ignored"""
+        from tracing import parse_traceparent
+        assert parse_traceparent('00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00') == \
+            ('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', False)
+        assert parse_traceparent('garbage') is None
+        assert parse_traceparent('00-' + '0' * 32 + '-00f067aa0ba902b7-01') is None
+        assert parse_traceparent('00-zzf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01') is None
+        # int(x, 16) accepts these, but they are not lowercase hex ids
+        assert parse_traceparent('00-4bf9_2f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01') is None
+        assert parse_traceparent('00-0x4bf92f3577b34da6a3ce929d0e0e47-00f067aa0ba902b7-01') is None
+        assert parse_traceparent('00-4bf92f3577b34da6a3ce929d0e0e4736-+0f067aa0ba902b7-01') is None
+        assert parse_traceparent('00-4BF92F3577B34DA6A3CE929D0E0E4736-00f067aa0ba902b7-01') is None
+        # Invalid version, short flags, and extra fields on version 00
+        assert parse_traceparent('ff-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01') is None
+        assert parse_traceparent('00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-1') is None
+        assert parse_traceparent('00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01-ab') is None
+        # Future versions may carry extra fields
+        assert parse_traceparent('01-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01-ab') == \
+            ('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7', True)
+        assert parse_traceparent('01-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01ab') is None
+
+    def test_encode_otlp(self):
+        """Encoded spans are valid OTLP/JSON with typed and escaped attributes"""
+        import tracing
+        span = tracing.Span('say "hi"', 'client', '4bf92f3577b34da6a3ce929d0e0e4736',
+                            '00f067aa0ba902b7', True,
+                            {'s': 'a"b\n', 'i': 3, 'f': 0.5, 'b': True})
+        span.set_error('bad "thing"')
+        span.end_ns = span.start_ns + 10
+
+        payload = json.loads(tracing.encode_otlp([span], service_name='svc'))
+        resource = payload['resourceSpans'][0]
+        assert resource['resource']['attributes'] == [
+            {'key': 'service.name', 'value': {'stringValue': 'svc'}}
+        ]
+        encoded = resource['scopeSpans'][0]['spans'][0]
+        assert encoded == {
+            'traceId': '4bf92f3577b34da6a3ce929d0e0e4736',
+            'spanId': span.span_id,
+            'parentSpanId': '00f067aa0ba902b7',
+            'name': 'say "hi"',
+            'kind': 3,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [
+                {'key': 's', 'value': {'stringValue': 'a"b\n'}},
+                {'key': 'i', 'value': {'intValue': '3'}},
+                {'key': 'f', 'value': {'doubleValue': 0.5}},
+                {'key': 'b', 'value': {'boolValue': True}},
+            ],
+            'status': {'code': tracing.STATUS_ERROR, 'message': 'bad "thing"'},
+        }
+
+    def test_start_span_begins_on_enter(self):
+        """Constructing start_span without entering it leaves the context untouched"""
+        import tracing
+        tracing.configure(enabled=True, sample_rate=1.0, exporter=Mock())
+        try:
+            scope = tracing.start_span('later')
+            assert tracing.current_span() is None
+            with tracing.start_span('outer') as outer:
+                with scope as inner:
+                    assert inner.parent_id == outer.span_id
+                assert tracing.current_span() is outer
+            assert tracing.current_span() is None
+        finally:
+            tracing.configure(enabled=False)
+
+    def test_file_exporter_batches(self, tmp_path):
+        """File exporter writes one OTLP/JSON line per batch"""
+        import tracing
+        path = tmp_path / 'traces.jsonl'
+        tracing.configure(enabled=True, sample_rate=1.0,
+                          exporter=tracing.FileSpanExporter(path), max_batch_size=2)
+        try:
+            for i in range(3):
+                with tracing.start_span(f'op{i}'):
+                    pass
+            tracing.force_flush()
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+            batch_sizes = [len(line['resourceSpans'][0]['scopeSpans'][0]['spans']) for line in lines]
+            assert batch_sizes == [2, 1]
+        finally:
+            tracing.configure(enabled=False)
+
+    def test_span_records_exception(self):
+        """Exceptions inside a span mark it as an error"""
+        import tracing
+        exported = []
+
+        class ListExporter:
+            def export(self, spans):
+                exported.extend(spans)
+
+            def shutdown(self):
+                pass
+
+        tracing.configure(enabled=True, sample_rate=1.0, exporter=ListExporter())
+        try:
+            with pytest.raises(ValueError):
+                with tracing.start_span('failing'):
+                    raise ValueError('boom')
+            tracing.force_flush()
+            assert exported[0].status == tracing.STATUS_ERROR
+            assert exported[0].status_message == 'boom'
+            assert tracing.current_span() is None
+        finally:
+            tracing.configure(enabled=False)
+
+    @pytest.mark.benchmark
+    @pytest.mark.skipif(not os.getenv('RUN_BENCHMARKS'),
+                        reason='wall-clock benchmark; set RUN_BENCHMARKS=1 to run')
+    def test_tracing_overhead_under_two_percent(self, client, tmp_path):
+        """Tracing work per /chat request, including export, costs under 2% of the request"""
+        import tracing
+        from app import app, start_request_trace, record_request_status, end_request_trace
+        path = tmp_path / 'traces.jsonl'
+
+        api_key = client.post('/auth/generate-key').json['api_key']
+        headers = {'Authorization': f'Bearer {api_key}'}
+
+        # End-to-end A/B timing of /chat is too noisy to resolve 2%, so time the
+        # untraced request and the tracing work it gains separately
+        def chat_request_time(rounds=5, n=20):
+            best = float('inf')
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(n):
+                    response = client.post('/chat', json={'prompt': 'bench'}, headers=headers)
+                    assert response.status_code == 200
+                best = min(best, (time.perf_counter() - start) / n)
+            return best
+
+        # The stages /chat traces, wrapped the same way app.py wraps them
+        stages = [tracing.traced(name)(lambda: None) for name in (
+            'auth.validate_api_key', 'db.get_or_create_session',
+            'db.save_message', 'db.save_message')]
+
+        def tracing_time(rounds=5, n=200):
+            best = float('inf')
+            with app.test_request_context('/chat', method='POST', headers=headers):
+                response = app.response_class(status=200)
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    for _ in range(n):
+                        start_request_trace()
+                        for stage in stages:
+                            stage()
+                        with tracing.start_span('azure.completions', kind='client',
+                                                attributes={'azure.deployment': 'd'}) as span:
+                            tracing.inject({})
+                            span.set_attribute('http.status_code', 200)
+                        record_request_status(response)
+                        end_request_trace(None)
+                    # Encoding and writing the spans is part of the cost
+                    tracing.force_flush()
+                    best = min(best, (time.perf_counter() - start) / n)
+            return best
+
+        try:
+            with patch('app.RATE_LIMIT_REQUESTS', 10 ** 6):
+                baseline = chat_request_time()
+            tracing.configure(enabled=True, sample_rate=1.0,
+                              exporter=tracing.FileSpanExporter(path), flush_interval=60)
+            overhead = tracing_time()
+        finally:
+            tracing.configure(enabled=False)
+
+        assert overhead / baseline < 0.02, (
+            f"tracing {overhead * 1e6:.1f}us vs request {baseline * 1e6:.1f}us"
+        )
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])